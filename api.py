@@ -0,0 +1,197 @@
+# --- Sagrado Doce - API de Pedidos (sem Streamlit) ---
+# Recebe pedidos do WhatsApp / site em JSON e usa as mesmas regras do app (pedidos.py):
+# venda, venda_itens, baixa de estoque e lançamento no caixa quando já vem pago.
+#
+# Rodar ao lado do app:  python api.py --porta 8600
+# Banco: variável SUPABASE_URL ou o mesmo .streamlit/secrets.toml do app.
+# Se API_TOKEN estiver definido, exige o cabeçalho "Authorization: Bearer <token>".
+# Sem API_TOKEN a API só aceita escutar em 127.0.0.1 (padrão).
+#
+# POST /pedidos                   {"cliente": ..., "itens": [{"receita_id": 1, "qtd": 2}], "chave": "wa-123", ...}
+# POST /pedidos/lote              {"pedidos": [ {...}, {...} ]}  (cada pedido na sua transação)
+# POST /pedidos/<id>/pagamento    marca como pago e lança no caixa
+# GET  /metricas                  vazão e latência desde que a API subiu
+# GET  /saude
+import argparse
+import ipaddress
+import json
+import os
+import threading
+import time
+import tomllib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+import pedidos
+
+MAX_PEDIDOS_LOTE = 500
+
+def get_db_url():
+    if os.environ.get("SUPABASE_URL"): return os.environ["SUPABASE_URL"]
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml"), "rb") as f:
+        return tomllib.load(f)["SUPABASE_URL"]
+
+# --- Métricas (em memória, por processo) ---
+class Metricas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inicio = time.time()
+        self.criados = 0
+        self.repetidos = 0
+        self.erros = 0
+        self.latencias = deque(maxlen=2000)  # ms por pedido, janela das últimas 2000
+        self.recentes = deque()               # instantes dos pedidos criados no último minuto
+
+    def registrar(self, resultado, ms):
+        agora = time.time()
+        with self.lock:
+            self.latencias.append(ms)
+            if 'erro' in resultado: self.erros += 1
+            elif resultado['repetido']: self.repetidos += 1
+            else:
+                self.criados += 1
+                self.recentes.append(agora)
+            while self.recentes and self.recentes[0] < agora - 60: self.recentes.popleft()
+
+    def resumo(self):
+        with self.lock:
+            lat = sorted(self.latencias)
+            uptime = time.time() - self.inicio
+            percentil = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))], 2) if lat else None
+            return {
+                'uptime_s': round(uptime, 1), 'criados': self.criados, 'repetidos': self.repetidos, 'erros': self.erros,
+                'pedidos_por_s': round(self.criados / uptime, 3) if uptime else 0,
+                'pedidos_ultimo_minuto': len(self.recentes),
+                'latencia_ms': {'p50': percentil(0.50), 'p95': percentil(0.95), 'p99': percentil(0.99), 'max': lat[-1] if lat else None},
+            }
+
+# --- Processamento ---
+def resolver_itens(cur, itens):
+    # Aceita {"receita_id": 3, "qtd": 2} ou {"produto": "Brigadeiro", "qtd": 2}
+    if not isinstance(itens, list) or not itens: raise ValueError("Campo 'itens' vazio")
+    if not all(isinstance(i, dict) for i in itens): raise ValueError("Cada item deve ser um objeto JSON")
+    nomes = [str(i['produto']).strip().lower() for i in itens if 'receita_id' not in i and i.get('produto')]
+    por_nome = {}
+    if nomes:
+        cur.execute("SELECT DISTINCT ON (lower(trim(nome))) id, lower(trim(nome)) AS chave FROM receitas WHERE lower(trim(nome)) = ANY(%s) ORDER BY lower(trim(nome)), id", (nomes,))
+        por_nome = {r['chave']: r['id'] for r in cur.fetchall()}
+    resolvidos = []
+    for i in itens:
+        if 'receita_id' in i: rid = i['receita_id']
+        elif str(i.get('produto', '')).strip().lower() in por_nome: rid = por_nome[str(i['produto']).strip().lower()]
+        else: raise ValueError(f"Produto não encontrado: {i.get('produto')}")
+        resolvidos.append({'id': int(rid), 'qtd': i.get('qtd', 1)})
+    return resolvidos
+
+def processar_pedido(conn, dados):
+    inicio = time.perf_counter()
+    try:
+        if not isinstance(dados, dict): raise ValueError("Pedido deve ser um objeto JSON")
+        # Só true/false de verdade: "false" ou "0" como texto lançariam no caixa um pedido não pago
+        pago = dados.get('pago', False)
+        if not isinstance(pago, bool): raise ValueError("Campo 'pago' deve ser true ou false")
+        with conn:  # commit no fim, rollback se der erro
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                itens = resolver_itens(cur, dados.get('itens'))
+                venda_id, repetido = pedidos.criar_pedido(
+                    cur, dados.get('cliente', ''), dados.get('tipo_entrega', 'Retirada'), dados.get('endereco', ''),
+                    dados.get('forma_pagamento', 'Pix'), itens, pago=pago, chave=dados.get('chave'))
+        resultado = {'venda_id': venda_id, 'repetido': repetido}
+    except (ValueError, KeyError, TypeError, OverflowError) as e:
+        resultado = {'erro': str(e)}
+    except psycopg2.Error as e:
+        resultado = {'erro': f"Erro no Banco: {e}"}
+    METRICAS.registrar(resultado, (time.perf_counter() - inicio) * 1000)
+    return resultado
+
+class Handler(BaseHTTPRequestHandler):
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def _autorizado(self):
+        token = os.environ.get("API_TOKEN")
+        return not token or self.headers.get("Authorization") == f"Bearer {token}"
+
+    def do_GET(self):
+        if self.path == "/saude": return self._responder(200, {'ok': True})
+        if not self._autorizado(): return self._responder(401, {'erro': 'Não autorizado'})
+        if self.path == "/metricas": return self._responder(200, METRICAS.resumo())
+        self._responder(404, {'erro': 'Rota não encontrada'})
+
+    def do_POST(self):
+        if not self._autorizado(): return self._responder(401, {'erro': 'Não autorizado'})
+        try:
+            tamanho = int(self.headers.get("Content-Length", 0))
+            if tamanho < 0: raise ValueError
+        except ValueError:
+            return self._responder(400, {'erro': 'Content-Length inválido'})
+        try:
+            corpo = json.loads(self.rfile.read(tamanho) or b"{}")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return self._responder(400, {'erro': 'JSON inválido'})
+
+        partes = self.path.strip("/").split("/")
+        conn = None
+        vaga = False
+        try:
+            VAGAS.acquire()  # Mais requisições que conexões: espera a vez em vez de estourar o pool
+            vaga = True
+            conn = POOL.getconn()
+            if partes == ["pedidos"]:
+                if isinstance(corpo, dict) and not corpo.get('chave') and self.headers.get("Idempotency-Key"): corpo['chave'] = self.headers["Idempotency-Key"]
+                res = processar_pedido(conn, corpo)
+                return self._responder(400 if 'erro' in res else (200 if res['repetido'] else 201), res)
+            if partes == ["pedidos", "lote"]:
+                lista = corpo.get('pedidos') if isinstance(corpo, dict) else None
+                if not isinstance(lista, list) or not lista: return self._responder(400, {'erro': "Campo 'pedidos' vazio"})
+                if len(lista) > MAX_PEDIDOS_LOTE: return self._responder(413, {'erro': f"Máximo de {MAX_PEDIDOS_LOTE} pedidos por lote"})
+                # Um pedido com erro não derruba os outros
+                resultados = [dict(processar_pedido(conn, p), indice=n) for n, p in enumerate(lista)]
+                return self._responder(200, {'resultados': resultados, 'criados': sum(1 for r in resultados if 'venda_id' in r and not r['repetido']),
+                                             'erros': sum(1 for r in resultados if 'erro' in r)})
+            if len(partes) == 3 and partes[0] == "pedidos" and partes[1].isdigit() and partes[2] == "pagamento":
+                with conn:
+                    with conn.cursor(cursor_factory=RealDictCursor) as cur: pago = pedidos.registrar_pagamento(cur, int(partes[1]))
+                return self._responder(200, {'venda_id': int(partes[1]), 'lancado_no_caixa': pago})
+            self._responder(404, {'erro': 'Rota não encontrada'})
+        except Exception as e:
+            self._responder(500, {'erro': f"Erro no Banco: {e}"})
+        finally:
+            if conn is not None: POOL.putconn(conn, close=bool(conn.closed))
+            if vaga: VAGAS.release()
+
+METRICAS = Metricas()
+POOL = None
+VAGAS = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API de pedidos do Sagrado Doce")
+    parser.add_argument("--host", default="127.0.0.1", help="Fora do 127.0.0.1 só com API_TOKEN definido")
+    parser.add_argument("--porta", type=int, default=8600)
+    parser.add_argument("--conexoes", type=int, default=10, help="Tamanho máximo do pool de conexões")
+    args = parser.parse_args()
+
+    # Sem token, ninguém na rede pode criar pedidos ou lançar no caixa
+    try: loopback = ipaddress.ip_address(args.host).is_loopback
+    except ValueError: loopback = args.host == "localhost"
+    if not loopback and not os.environ.get("API_TOKEN"):
+        parser.error(f"Defina API_TOKEN para escutar em {args.host} (sem token, use 127.0.0.1)")
+
+    POOL = ThreadedConnectionPool(1, args.conexoes, get_db_url())
+    VAGAS = threading.BoundedSemaphore(args.conexoes)
+    conn = POOL.getconn()
+    with conn:
+        with conn.cursor() as cur: cur.execute(pedidos.DDL_IDEMPOTENCIA)
+    POOL.putconn(conn)
+
+    print(f"API de pedidos em http://{args.host}:{args.porta}")
+    ThreadingHTTPServer((args.host, args.porta), Handler).serve_forever()
@@ -1,12 +1,21 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import base64
 import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import time
 import json
+import csv
+import io
+import sqlite3
+import uuid
+import zlib
+import re
+import math
+import tempfile
+import pedidos
 
 # --- Configuração da Página ---
 st.set_page_config(page_title="Sagrado Doce - Sistema", layout="wide", page_icon="🍰")
@@ -52,6 +61,22 @@ def run_query(query, params=None):
             st.error(f"Erro no Banco: {e}")
             return None
 
+def run_transaction(func):
+    # Executa func(cur) numa única transação: ou grava tudo, ou nada
+    conn = get_db_connection()
+    conn.autocommit = False
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            resultado = func(cur)
+        conn.commit()
+        return resultado
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erro no Banco (nada foi gravado): {e}")
+        return None
+    finally:
+        conn.close()
+
 # --- Inicialização do Banco ---
 def init_db():
     # Cria tabelas se não existirem
@@ -69,13 +94,115 @@ def init_db():
     try: run_query("ALTER TABLE insumos ADD COLUMN estoque_minimo REAL DEFAULT 0")
     except: pass
 
+    run_query(pedidos.DDL_IDEMPOTENCIA)
+
+    # Arquivo morto: mesmas colunas das tabelas quentes, para o UNION ALL dos relatórios
+    run_query('''CREATE TABLE IF NOT EXISTS vendas_arquivo (LIKE vendas INCLUDING INDEXES)''')
+    run_query('''CREATE TABLE IF NOT EXISTS venda_itens_arquivo (LIKE venda_itens INCLUDING INDEXES)''')
+    run_query('''CREATE TABLE IF NOT EXISTS caixa_arquivo (LIKE caixa INCLUDING INDEXES)''')
+    run_query('''CREATE TABLE IF NOT EXISTS caixa_arquivo_resumo (mes DATE, tipo TEXT, valor REAL, PRIMARY KEY (mes, tipo))''')
+
+    # Índices do caminho quente (Produção, A Receber, Financeiro)
+    run_query("CREATE INDEX IF NOT EXISTS idx_vendas_status ON vendas (status)")
+    run_query("CREATE INDEX IF NOT EXISTS idx_vendas_pendentes ON vendas (status_pagamento) WHERE status_pagamento = 'Pendente'")
+    run_query("CREATE INDEX IF NOT EXISTS idx_venda_itens_venda ON venda_itens (venda_id)")
+    run_query("CREATE INDEX IF NOT EXISTS idx_caixa_data ON caixa (data_movimento)")
+    run_query("CREATE INDEX IF NOT EXISTS idx_vendas_arquivo_data ON vendas_arquivo (data_pedido)")
+    run_query("CREATE INDEX IF NOT EXISTS idx_venda_itens_arquivo_venda ON venda_itens_arquivo (venda_id)")
+    run_query("CREATE INDEX IF NOT EXISTS idx_caixa_arquivo_data ON caixa_arquivo (data_movimento)")
+
 if 'db_initialized' not in st.session_state:
     init_db()
     st.session_state.db_initialized = True
 
+# --- ESTADO COMPARTILHADO (VÁRIAS RÉPLICAS) ---
+# Carrinhos e rascunho de receita saem da memória do processo e vão para um store externo,
+# identificados pelo ?sessao= da URL. Assim qualquer réplica atrás do balanceador (ou o mesmo
+# processo depois de reiniciar) continua de onde o usuário parou.
+# Configuração em secrets.toml: STATE_BACKEND = "memoria" (padrão) | "banco" | "sqlite"
+# Teste local: STATE_BACKEND = "sqlite", rode "streamlit run app.py --server.port 8501" e outro
+# na 8502, e abra a mesma URL com ?sessao=teste nas duas portas.
+# O rascunho de receita leva junto o modo e os campos de nome/preço: sem eles, a regra que
+# limpa o rascunho ao voltar para "Nova (Do Zero)" apagaria a edição restaurada
+CHAVES_COMPARTILHADAS = ["carrinho", "carrinho_orc", "ingredientes_temp", "editando_id", "rec_modo", "rec_nome_in", "rec_venda_in"]
+
+class EstadoBanco:
+    # Tabela no próprio Postgres do sistema
+    def __init__(self):
+        run_query("CREATE TABLE IF NOT EXISTS sessoes_estado (sessao_id TEXT PRIMARY KEY, dados BYTEA, atualizado_em TIMESTAMP)")
+        run_query("DELETE FROM sessoes_estado WHERE atualizado_em < NOW() - INTERVAL '7 days'")
+
+    def carregar(self, sessao_id):
+        data = run_query("SELECT dados FROM sessoes_estado WHERE sessao_id = %s", (sessao_id,))
+        return bytes(data[0]['dados']) if data else None
+
+    def salvar(self, sessao_id, blob):
+        run_query("INSERT INTO sessoes_estado (sessao_id, dados, atualizado_em) VALUES (%s, %s, NOW()) ON CONFLICT (sessao_id) DO UPDATE SET dados = EXCLUDED.dados, atualizado_em = NOW()",
+                  (sessao_id, psycopg2.Binary(blob)))
+
+class EstadoSQLite:
+    # Chave-valor local: serve para réplicas na mesma máquina sem ir ao banco remoto
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._executar("CREATE TABLE IF NOT EXISTS sessoes_estado (sessao_id TEXT PRIMARY KEY, dados BLOB, atualizado_em REAL)")
+        self._executar("DELETE FROM sessoes_estado WHERE atualizado_em < ?", (time.time() - 7 * 86400,))
+
+    def _executar(self, query, params=()):
+        conn = sqlite3.connect(self.caminho, timeout=5)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn: return conn.execute(query, params).fetchone()
+        finally:
+            conn.close()
+
+    def carregar(self, sessao_id):
+        row = self._executar("SELECT dados FROM sessoes_estado WHERE sessao_id = ?", (sessao_id,))
+        return bytes(row[0]) if row else None
+
+    def salvar(self, sessao_id, blob):
+        self._executar("INSERT INTO sessoes_estado (sessao_id, dados, atualizado_em) VALUES (?, ?, ?) ON CONFLICT(sessao_id) DO UPDATE SET dados = excluded.dados, atualizado_em = excluded.atualizado_em",
+                       (sessao_id, blob, time.time()))
+
+@st.cache_resource
+def get_estado_store():
+    # Um store por processo; None = só memória (comportamento original)
+    backend = st.secrets.get("STATE_BACKEND", "memoria")
+    if backend == "banco": return EstadoBanco()
+    if backend == "sqlite": return EstadoSQLite(st.secrets.get("STATE_SQLITE_PATH", "estado_sessoes.db"))
+    return None
+
+def carregar_estado_compartilhado():
+    # Só na primeira execução da sessão; depois o session_state local já está em dia
+    store = get_estado_store()
+    if store is None or 'estado_sessao_id' in st.session_state: return
+    sessao_id = st.query_params.get("sessao")
+    if not sessao_id:
+        sessao_id = uuid.uuid4().hex
+        st.query_params["sessao"] = sessao_id
+    st.session_state.estado_sessao_id = sessao_id
+    st.session_state.estado_ultimo_json = None
+    blob = store.carregar(sessao_id)
+    if blob:
+        texto = zlib.decompress(blob).decode("utf-8")
+        st.session_state.estado_ultimo_json = texto
+        for k, v in json.loads(texto).items(): st.session_state[k] = v
+
+def salvar_estado_compartilhado():
+    # Chamada uma vez no fim do script: várias alterações no mesmo rerun viram uma escrita só,
+    # e reruns que não mudaram nada não escrevem
+    store = get_estado_store()
+    if store is None or 'estado_sessao_id' not in st.session_state: return
+    estado = {k: st.session_state[k] for k in CHAVES_COMPARTILHADAS if k in st.session_state}
+    texto = json.dumps(estado, separators=(",", ":"), sort_keys=True, default=str)
+    if texto == st.session_state.estado_ultimo_json: return
+    store.salvar(st.session_state.estado_sessao_id, zlib.compress(texto.encode("utf-8")))
+    st.session_state.estado_ultimo_json = texto
+
+carregar_estado_compartilhado()
+
 # --- SISTEMA DE BACKUP E RESTAURAÇÃO ---
 def gerar_backup_json():
-    tabelas = ["insumos", "receitas", "vendas", "caixa", "vendedoras", "receita_itens", "venda_itens", "consignacoes"]
+    tabelas = ["insumos", "receitas", "vendas", "caixa", "vendedoras", "receita_itens", "venda_itens", "consignacoes", "vendas_arquivo", "venda_itens_arquivo", "caixa_arquivo"]
     backup = {}
     for tabela in tabelas:
         dados = run_query(f"SELECT * FROM {tabela}")
@@ -95,38 +222,174 @@ def gerar_backup_json():
 def restaurar_backup(arquivo_json):
     try:
         dados_backup = json.load(arquivo_json)
-        ordem_restauracao = ["insumos", "receitas", "vendedoras", "vendas", "receita_itens", "venda_itens", "caixa", "consignacoes"]
+        ordem_restauracao = ["insumos", "receitas", "vendedoras", "vendas", "receita_itens", "venda_itens", "caixa", "consignacoes", "vendas_arquivo", "venda_itens_arquivo", "caixa_arquivo"]
         
+        # Um id vive na tabela quente OU no arquivo: backup anterior ao arquivamento não pode duplicar
+        pares_arquivo = {"vendas": "vendas_arquivo", "venda_itens": "venda_itens_arquivo", "caixa": "caixa_arquivo"}
+        pares_arquivo.update({v: k for k, v in pares_arquivo.items()})
+
         status_log = []
         for tabela in ordem_restauracao:
             if tabela in dados_backup and len(dados_backup[tabela]) > 0:
                 rows = dados_backup[tabela]
                 sucesso = 0
+                ids_no_par = set()
+                if tabela in pares_arquivo:
+                    ids_no_par = {r['id'] for r in (run_query(f"SELECT id FROM {pares_arquivo[tabela]}") or [])}
                 for row in rows:
+                    if row.get('id') in ids_no_par: continue
                     cols = list(row.keys())
                     vals = [row[c] for c in cols]
                     placeholders = ["%s"] * len(cols)
                     q = f"INSERT INTO {tabela} ({','.join(cols)}) VALUES ({','.join(placeholders)}) ON CONFLICT (id) DO NOTHING"
                     run_query(q, tuple(vals))
                     sucesso += 1
-                status_log.append(f"✅ {tabela}: {sucesso} itens restaurados.")
+                pulados = len(rows) - sucesso
+                status_log.append(f"✅ {tabela}: {sucesso} itens restaurados." + (f" ({pulados} já estavam em {pares_arquivo[tabela]})" if pulados else ""))
                 
-        # Atualiza a sequência dos IDs
+        # Atualiza a sequência dos IDs (tabelas de arquivo usam a sequência da tabela quente)
         for t in ordem_restauracao:
-            try: run_query(f"SELECT setval('{t}_id_seq', (SELECT MAX(id) FROM {t}));")
+            if t.endswith("_arquivo"): continue
+            max_id = f"(SELECT MAX(id) FROM {t})"
+            if f"{t}_arquivo" in ordem_restauracao: max_id = f"GREATEST({max_id}, (SELECT MAX(id) FROM {t}_arquivo))"
+            try: run_query(f"SELECT setval('{t}_id_seq', {max_id});")
             except: pass
+        recalcular_resumo_arquivo()
             
         return "\n".join(status_log)
     except Exception as e:
         return f"Erro ao ler arquivo: {str(e)}"
 
+# --- ARQUIVO MORTO (HISTÓRICO DE VENDAS E CAIXA) ---
+# Pedidos concluídos e pagos e movimentos de caixa antigos saem das tabelas quentes,
+# então Produção, A Receber e o Financeiro consultam sempre um volume pequeno.
+# Colunas nomeadas (nada de SELECT *): uma coluna nova na tabela quente não desalinha o arquivo.
+# Coluna nova que deva ir para o histórico: ALTER TABLE também no _arquivo e inclua aqui.
+COLUNAS_ARQUIVO = {
+    "vendas": "id, cliente, data_pedido, tipo_entrega, endereco, forma_pagamento, itens_resumo, total_venda, status, status_pagamento",
+    "venda_itens": "id, venda_id, receita_id, qtd",
+    "caixa": "id, descricao, valor, data_movimento, tipo, categoria",
+}
+
+def arquivar_historico(meses):
+    def _mover(cur):
+        corte = "NOW() - make_interval(months => %s)"
+        # Ids escolhidos uma vez só (e travados): itens e vendas saem exatamente do mesmo conjunto
+        cur.execute(f"SELECT id FROM vendas WHERE status = 'Concluído' AND status_pagamento = 'Pago' AND data_pedido < {corte} FOR UPDATE", (meses,))
+        fechadas = [r['id'] for r in cur.fetchall()]
+        c_itens, c_vendas, c_caixa = COLUNAS_ARQUIVO["venda_itens"], COLUNAS_ARQUIVO["vendas"], COLUNAS_ARQUIVO["caixa"]
+        cur.execute(f"WITH movidos AS (DELETE FROM venda_itens WHERE venda_id = ANY(%s) RETURNING {c_itens}) INSERT INTO venda_itens_arquivo ({c_itens}) SELECT {c_itens} FROM movidos", (fechadas,))
+        cur.execute(f"WITH movidas AS (DELETE FROM vendas WHERE id = ANY(%s) RETURNING {c_vendas}) INSERT INTO vendas_arquivo ({c_vendas}) SELECT {c_vendas} FROM movidas", (fechadas,))
+        vendas = cur.rowcount
+        # O resumo mensal mantém o "Saldo Atual" sem precisar varrer o arquivo
+        cur.execute(f"""
+            WITH movidos AS (DELETE FROM caixa WHERE data_movimento < {corte} RETURNING {c_caixa}),
+                 arquivados AS (INSERT INTO caixa_arquivo ({c_caixa}) SELECT {c_caixa} FROM movidos RETURNING 1),
+                 resumo AS (
+                    INSERT INTO caixa_arquivo_resumo (mes, tipo, valor)
+                    SELECT date_trunc('month', data_movimento)::date, tipo, SUM(valor) FROM movidos GROUP BY 1, 2
+                    ON CONFLICT (mes, tipo) DO UPDATE SET valor = caixa_arquivo_resumo.valor + EXCLUDED.valor
+                    RETURNING 1)
+            SELECT COUNT(*) AS n FROM arquivados
+        """, (meses,))
+        return {'vendas': vendas, 'caixa': cur.fetchone()['n']}
+    return run_transaction(_mover)
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def arquivamento_automatico(meses):
+    # No máximo uma vez por dia por processo
+    return arquivar_historico(meses)
+
+def recalcular_resumo_arquivo():
+    run_query("DELETE FROM caixa_arquivo_resumo")
+    run_query("INSERT INTO caixa_arquivo_resumo (mes, tipo, valor) SELECT date_trunc('month', data_movimento)::date, tipo, SUM(valor) FROM caixa_arquivo GROUP BY 1, 2")
+
+def montar_consulta_historico(tabela, coluna_data, data_ini, data_fim, colunas=None, filtros=None):
+    # Só junta o arquivo morto quando o período pedido alcança datas já arquivadas
+    # filtros: {coluna: [valores aceitos]}
+    colunas = colunas or COLUNAS_ARQUIVO[tabela]
+    filtros = filtros or {}
+    where = f"{coluna_data} >= %s AND {coluna_data} < %s" + "".join(f" AND {c} = ANY(%s)" for c in filtros)
+    params = (data_ini, data_fim + timedelta(days=1)) + tuple(list(v) for v in filtros.values())
+    query = f"SELECT {colunas} FROM {tabela} WHERE {where}"
+    limite = run_query(f"SELECT MAX({coluna_data}) AS limite FROM {tabela}_arquivo")
+    if limite and limite[0]['limite'] and data_ini <= limite[0]['limite'].date():
+        query += f" UNION ALL SELECT {colunas} FROM {tabela}_arquivo WHERE {where}"
+        params += params
+    return query, params
+
+def consultar_historico(tabela, coluna_data, data_ini, data_fim):
+    query, params = montar_consulta_historico(tabela, coluna_data, data_ini, data_fim)
+    return run_query(query, params)
+
+def saldo_por_tipo():
+    # Caixa quente + resumo mensal do arquivo (não cresce com o histórico)
+    data = run_query("SELECT tipo, SUM(valor) AS total FROM (SELECT tipo, valor FROM caixa UNION ALL SELECT tipo, valor FROM caixa_arquivo_resumo) t GROUP BY tipo")
+    return {r['tipo']: float(r['total'] or 0) for r in (data or [])}
+
+if 'ARQUIVAR_APOS_MESES' in st.secrets:
+    arquivamento_automatico(int(st.secrets['ARQUIVAR_APOS_MESES']))
+
+# --- EXPORTAÇÃO DO EXTRATO (CONTABILIDADE) ---
+# Lê por cursor nomeado (server-side) em lotes fixos e grava direto no arquivo,
+# então a memória não cresce com o tamanho do período exportado.
+TAMANHO_LOTE_EXPORT = 5000
+COLUNAS_EXPORTACAO = {
+    "caixa": ("data_movimento", [("id", "int"), ("data_movimento", "data"), ("tipo", "texto"), ("categoria", "texto"), ("descricao", "texto"), ("valor", "num")]),
+    "vendas": ("data_pedido", [("id", "int"), ("data_pedido", "data"), ("cliente", "texto"), ("tipo_entrega", "texto"), ("endereco", "texto"), ("forma_pagamento", "texto"),
+                               ("itens_resumo", "texto"), ("total_venda", "num"), ("status", "texto"), ("status_pagamento", "texto")]),
+}
+
+def exportar_historico(tabela, data_ini, data_fim, filtros, formato, caminho, progresso):
+    coluna_data, campos = COLUNAS_EXPORTACAO[tabela]
+    colunas = [c for c, _ in campos]
+    query, params = montar_consulta_historico(tabela, coluna_data, data_ini, data_fim, ", ".join(colunas), filtros)
+    contagem = run_query(f"SELECT COUNT(*) AS n FROM ({query}) t", params)
+    if not contagem:  # run_query devolve None quando o banco dá erro (e já mostrou o motivo)
+        st.error("Erro na exportação: não foi possível consultar o período.")
+        return None
+    total = contagem[0]['n']
+
+    conn = get_db_connection()
+    conn.autocommit = False  # Cursor nomeado só existe dentro de uma transação
+    lidas, escritor, arq_csv = 0, None, None
+    try:
+        if formato == "Parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            tipos = {"int": pa.int64(), "data": pa.timestamp("us"), "texto": pa.string(), "num": pa.float64()}
+            schema = pa.schema([(c, tipos[t]) for c, t in campos])
+            escritor = pq.ParquetWriter(caminho, schema)
+        else:
+            arq_csv = open(caminho, "w", encoding="utf-8-sig", newline="")
+            # Cabeçalho mesmo se o período vier vazio
+            pd.DataFrame(columns=colunas).to_csv(arq_csv, sep=";", index=False)
+
+        with conn.cursor(name=f"exportar_{tabela}") as cur:
+            cur.itersize = TAMANHO_LOTE_EXPORT
+            cur.execute(f"SELECT * FROM ({query}) t ORDER BY {coluna_data}, id", params)
+            while True:
+                linhas = cur.fetchmany(TAMANHO_LOTE_EXPORT)
+                if not linhas: break
+                lote = pd.DataFrame(linhas, columns=colunas)
+                if escritor: escritor.write_table(pa.Table.from_pandas(lote, schema=schema, preserve_index=False))
+                else: lote.to_csv(arq_csv, sep=";", decimal=",", index=False, header=False, date_format="%d/%m/%Y %H:%M:%S")
+                lidas += len(linhas)
+                progresso.progress(lidas / max(total, lidas), text=f"{lidas} de {max(total, lidas)} linhas")
+        progresso.progress(1.0, text=f"{lidas} linhas exportadas")
+        return lidas
+    except Exception as e:
+        st.error(f"Erro na exportação: {e}")
+        return None
+    finally:
+        if escritor: escritor.close()
+        if arq_csv: arq_csv.close()
+        conn.rollback()
+        conn.close()
+
 # --- Lógica de Negócio ---
-def baixar_estoque_por_venda(receita_id, qtd_vendida):
-    ingredientes = run_query("SELECT insumo_id, qtd_usada FROM receita_itens WHERE receita_id = %s", (receita_id,))
-    if ingredientes:
-        for item in ingredientes:
-            total_descontar = float(item['qtd_usada']) * float(qtd_vendida)
-            run_query("UPDATE insumos SET estoque_atual = estoque_atual - %s WHERE id = %s", (total_descontar, item['insumo_id']))
+# As regras de pedido (venda, itens, baixa de estoque, pagamento) ficam em pedidos.py,
+# compartilhadas com a API (api.py)
 
 def format_currency(value): return f"R$ {float(value):,.2f}"
 
@@ -139,6 +402,208 @@ def get_base64_image(image_path):
         with open(image_path, "rb") as img_file: return base64.b64encode(img_file.read()).decode()
     return None
 
+# --- IMPORTAÇÃO EM LOTE (CSV/XLSX) ---
+# Unidade de compra -> unidade de uso (mesma regra do "Salvar Insumo": kg e L são x1000)
+UNIDADES_COMPRA = {"kg": "kg", "g": "g", "l": "L", "ml": "mL", "un": "un"}
+UNIDADE_BASE = {"kg": "g", "g": "g", "L": "mL", "mL": "mL", "un": "un"}
+UNIDADES_USO = {"g": "g", "ml": "mL", "un": "un"}
+
+def converter_embalagem(custo_embalagem, qtd_embalagem, unidade_compra):
+    qtd_total_base = qtd_embalagem * 1000 if unidade_compra in ["kg", "L"] else qtd_embalagem
+    return qtd_total_base, custo_embalagem / qtd_total_base
+
+def para_numero(valor):
+    # Aceita "12,50", "1.234,56", "R$ 8,90", "12.5" e "1.000" (ponto de milhar, padrão BR);
+    # "0.500" continua decimal. Infinito/NaN viram None (inválido)
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)): return None
+    if isinstance(valor, (int, float)): numero = float(valor)
+    else:
+        txt = str(valor).replace("R$", "").strip()
+        if not txt: return None
+        if "," in txt or re.fullmatch(r"-?[1-9]\d{0,2}(\.\d{3})+", txt): txt = txt.replace(".", "").replace(",", ".")
+        try: numero = float(txt)
+        except ValueError: return None
+    return numero if math.isfinite(numero) else None
+
+def para_texto(valor):
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)): return ""
+    return str(valor).strip()
+
+def ler_planilha(arquivo):
+    try:
+        if arquivo.name.lower().endswith(".xlsx"):
+            df = pd.read_excel(arquivo)  # Células numéricas já vêm como número, sem ambiguidade de ponto/vírgula
+        else:
+            df = pd.read_csv(arquivo, sep=None, engine="python", dtype=str, encoding="utf-8-sig")
+    except Exception as e:
+        st.error(f"Não consegui ler a planilha: {e}")
+        return None
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    df.index = df.index + 2  # Linha 1 é o cabeçalho, igual ao Excel
+    return df.dropna(how="all")
+
+def copiar_para_staging(cur, tabela, colunas, linhas):
+    # COPY em vez de um INSERT por linha
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(linhas)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def validar_planilha_insumos(df):
+    obrigatorias = ["nome", "custo_embalagem", "qtd_embalagem", "unidade_compra"]
+    faltando = [c for c in obrigatorias if c not in df.columns]
+    if faltando: return [], [{'linha': '-', 'erro': f"Colunas obrigatórias ausentes: {', '.join(faltando)}"}]
+
+    # Unidade de quem já existe: receita_itens.qtd_usada está gravada nela
+    data = run_query("SELECT nome, unidade_medida FROM insumos")
+    unidade_atual = {r['nome'].strip().lower(): r['unidade_medida'] for r in (data or []) if r['nome']}
+
+    registros, erros, vistos = [], [], {}
+    for linha, row in df.iterrows():
+        nome = para_texto(row['nome'])
+        custo = para_numero(row['custo_embalagem'])
+        qtd = para_numero(row['qtd_embalagem'])
+        un_compra = UNIDADES_COMPRA.get(para_texto(row['unidade_compra']).lower())
+        un_uso_txt = para_texto(row.get('unidade_medida'))
+        minimo_txt = para_texto(row.get('estoque_minimo'))
+        minimo = para_numero(minimo_txt) if minimo_txt else None
+
+        if not nome: erro = "Nome vazio"
+        elif nome.lower() in vistos: erro = f"Insumo repetido na planilha (já está na linha {vistos[nome.lower()]})"
+        elif not custo or custo <= 0: erro = "Custo da embalagem inválido"
+        elif not qtd or qtd <= 0: erro = "Qtd da embalagem inválida"
+        elif not un_compra: erro = f"Unidade de compra inválida: '{para_texto(row['unidade_compra'])}' (use kg, g, L, mL ou un)"
+        elif un_uso_txt and UNIDADES_USO.get(un_uso_txt.split()[0].lower()) is None: erro = f"Unidade de uso inválida: '{un_uso_txt}' (use g, mL ou un)"
+        elif un_uso_txt and UNIDADES_USO[un_uso_txt.split()[0].lower()] != UNIDADE_BASE[un_compra]: erro = f"Unidade de compra {un_compra} não converte para {un_uso_txt.split()[0]}"
+        elif minimo_txt and (minimo is None or minimo < 0): erro = "Estoque mínimo inválido"
+        elif nome.lower() in unidade_atual and unidade_atual[nome.lower()] != UNIDADE_BASE[un_compra]:
+            erro = f"Insumo já cadastrado em {unidade_atual[nome.lower()]}; a planilha usa {UNIDADE_BASE[un_compra]} (as receitas ficariam com custo errado)"
+        else: erro = None
+
+        if erro:
+            erros.append({'linha': linha, 'erro': erro}); continue
+        vistos[nome.lower()] = linha
+        qtd_total_base, _ = converter_embalagem(custo, qtd, un_compra)
+        registros.append((nome, UNIDADE_BASE[un_compra], custo, qtd_total_base, minimo))
+    return registros, erros
+
+def importar_insumos_em_lote(registros):
+    def _merge(cur):
+        cur.execute("CREATE TEMP TABLE stg_insumos (nome TEXT, unidade_medida TEXT, custo_total REAL, qtd_embalagem REAL, estoque_minimo REAL) ON COMMIT DROP")
+        copiar_para_staging(cur, "stg_insumos", ["nome", "unidade_medida", "custo_total", "qtd_embalagem", "estoque_minimo"], registros)
+        # Atualiza quem já existe (pelo nome) e recalcula o custo unitário de uma vez só
+        cur.execute("""
+            UPDATE insumos i
+            SET custo_total = s.custo_total, qtd_embalagem = s.qtd_embalagem,
+                custo_unitario = s.custo_total / s.qtd_embalagem, estoque_minimo = COALESCE(s.estoque_minimo, i.estoque_minimo)
+            FROM stg_insumos s WHERE lower(trim(i.nome)) = lower(s.nome)
+            RETURNING i.id
+        """)
+        ids_atualizados = [r['id'] for r in cur.fetchall()]
+        cur.execute("""
+            INSERT INTO insumos (nome, unidade_medida, custo_total, qtd_embalagem, fator_conversao, custo_unitario, estoque_atual, estoque_minimo)
+            SELECT s.nome, s.unidade_medida, s.custo_total, s.qtd_embalagem, 1, s.custo_total / s.qtd_embalagem, 0, COALESCE(s.estoque_minimo, 0)
+            FROM stg_insumos s WHERE NOT EXISTS (SELECT 1 FROM insumos i WHERE lower(trim(i.nome)) = lower(s.nome))
+        """)
+        novos = cur.rowcount
+        # Preço mudou -> custo das receitas que usam esses insumos também muda
+        receitas_afetadas = 0
+        if ids_atualizados:
+            cur.execute("UPDATE receita_itens ri SET custo_item = ri.qtd_usada * i.custo_unitario FROM insumos i WHERE ri.insumo_id = i.id AND i.id = ANY(%s)", (ids_atualizados,))
+            cur.execute("""
+                UPDATE receitas r SET custo_total = t.total
+                FROM (SELECT receita_id, SUM(custo_item) AS total FROM receita_itens
+                      WHERE receita_id IN (SELECT receita_id FROM receita_itens WHERE insumo_id = ANY(%s))
+                      GROUP BY receita_id) t
+                WHERE r.id = t.receita_id
+            """, (ids_atualizados,))
+            receitas_afetadas = cur.rowcount
+        return {'novos': novos, 'atualizados': len(ids_atualizados), 'receitas': receitas_afetadas}
+    return run_transaction(_merge)
+
+def validar_planilha_receitas(df):
+    obrigatorias = ["receita", "insumo", "qtd_usada"]
+    faltando = [c for c in obrigatorias if c not in df.columns]
+    if faltando: return [], [{'linha': '-', 'erro': f"Colunas obrigatórias ausentes: {', '.join(faltando)}"}]
+
+    data = run_query("SELECT id, nome FROM insumos")
+    insumos_por_nome = {r['nome'].strip().lower(): r['id'] for r in (data or []) if r['nome']}
+
+    linhas_ok, erros, precos, receitas_com_erro = [], [], {}, set()
+    for linha, row in df.iterrows():
+        receita = para_texto(row['receita'])
+        insumo = para_texto(row['insumo'])
+        qtd = para_numero(row['qtd_usada'])
+        preco_txt = para_texto(row.get('preco_venda'))
+        preco = para_numero(preco_txt) if preco_txt else None
+
+        if not receita: erro = "Nome da receita vazio"
+        elif insumo.lower() not in insumos_por_nome: erro = f"Insumo não cadastrado: '{insumo}'"
+        elif not qtd or qtd <= 0: erro = "Qtd usada inválida"
+        elif preco_txt and (preco is None or preco < 0): erro = "Preço de venda inválido"
+        else: erro = None
+
+        if erro:
+            erros.append({'linha': linha, 'erro': erro})
+            if receita: receitas_com_erro.add(receita.lower())
+            continue
+        if preco is not None: precos.setdefault(receita.lower(), preco)
+        linhas_ok.append((linha, receita, insumos_por_nome[insumo.lower()], qtd))
+
+    # Receita com ingrediente inválido não entra pela metade (o custo ficaria errado)
+    registros = []
+    for linha, receita, insumo_id, qtd in linhas_ok:
+        if receita.lower() in receitas_com_erro:
+            erros.append({'linha': linha, 'erro': f"Receita '{receita}' ignorada: há erros em outras linhas dela"})
+        else:
+            registros.append((receita, precos.get(receita.lower()), insumo_id, qtd))
+    return registros, sorted(erros, key=lambda e: e['linha'])
+
+def importar_receitas_em_lote(registros):
+    def _merge(cur):
+        cur.execute("CREATE TEMP TABLE stg_receita_itens (receita TEXT, preco_venda REAL, insumo_id INTEGER, qtd_usada REAL) ON COMMIT DROP")
+        copiar_para_staging(cur, "stg_receita_itens", ["receita", "preco_venda", "insumo_id", "qtd_usada"], registros)
+        cur.execute("""
+            INSERT INTO receitas (nome, preco_venda, custo_total)
+            SELECT MIN(s.receita), COALESCE(MAX(s.preco_venda), 0), 0 FROM stg_receita_itens s
+            WHERE NOT EXISTS (SELECT 1 FROM receitas r WHERE lower(trim(r.nome)) = lower(s.receita))
+            GROUP BY lower(s.receita)
+        """)
+        novas = cur.rowcount
+        # Se houver nomes repetidos no banco, a planilha vale para a receita mais antiga
+        cur.execute("""
+            CREATE TEMP TABLE map_receitas ON COMMIT DROP AS
+            SELECT DISTINCT ON (lower(trim(r.nome))) r.id, lower(trim(r.nome)) AS chave
+            FROM receitas r WHERE lower(trim(r.nome)) IN (SELECT lower(receita) FROM stg_receita_itens)
+            ORDER BY lower(trim(r.nome)), r.id
+        """)
+        cur.execute("""
+            UPDATE receitas r SET preco_venda = COALESCE(p.preco_venda, r.preco_venda)
+            FROM map_receitas m JOIN (SELECT lower(receita) AS chave, MAX(preco_venda) AS preco_venda FROM stg_receita_itens GROUP BY lower(receita)) p ON p.chave = m.chave
+            WHERE r.id = m.id
+        """)
+        cur.execute("DELETE FROM receita_itens WHERE receita_id IN (SELECT id FROM map_receitas)")
+        cur.execute("""
+            INSERT INTO receita_itens (receita_id, insumo_id, qtd_usada, custo_item)
+            SELECT m.id, s.insumo_id, s.qtd_usada, s.qtd_usada * i.custo_unitario
+            FROM stg_receita_itens s JOIN map_receitas m ON m.chave = lower(s.receita) JOIN insumos i ON i.id = s.insumo_id
+        """)
+        cur.execute("""
+            UPDATE receitas r SET custo_total = t.total
+            FROM (SELECT receita_id, SUM(custo_item) AS total FROM receita_itens WHERE receita_id IN (SELECT id FROM map_receitas) GROUP BY receita_id) t
+            WHERE r.id = t.receita_id
+        """)
+        return {'novas': novas, 'atualizadas': cur.rowcount - novas}
+    return run_transaction(_merge)
+
+def mostrar_relatorio_erros(erros, nome_arquivo):
+    if not erros: return
+    st.warning(f"{len(erros)} linha(s) com problema não foram importadas:")
+    df_erros = pd.DataFrame(erros)
+    st.dataframe(df_erros, use_container_width=True)
+    st.download_button("Baixar relatório de erros (.csv)", data=df_erros.to_csv(index=False).encode("utf-8-sig"),
+                       file_name=f"erros_importacao_{nome_arquivo}.csv", mime="text/csv", key=f"dl_erros_{nome_arquivo}")
+
 # --- CSS ---
 st.markdown("""
     <style>
@@ -170,12 +635,23 @@ with tab1:
 
     if st.button("Salvar Insumo"):
         if nome_insumo and custo_embalagem and qtd_embalagem:
-            qtd_total_base = qtd_embalagem * 1000 if unidade_compra in ["kg", "L"] else qtd_embalagem
-            custo_unitario_calc = custo_embalagem / qtd_total_base
+            qtd_total_base, custo_unitario_calc = converter_embalagem(custo_embalagem, qtd_embalagem, unidade_compra)
             run_query("INSERT INTO insumos (nome, unidade_medida, custo_total, qtd_embalagem, fator_conversao, custo_unitario, estoque_atual, estoque_minimo) VALUES (%s, %s, %s, %s, %s, %s, 0, %s)",
                       (nome_insumo, unidade_tipo.split()[0], float(custo_embalagem), float(qtd_total_base), 1, float(custo_unitario_calc), float(minimo)))
             st.success("Salvo!"); time.sleep(0.3); st.rerun()
     
+    with st.expander("📥 Importar Planilha de Insumos (CSV/XLSX)"):
+        st.caption("Colunas: nome, custo_embalagem, qtd_embalagem, unidade_compra (kg, g, L, mL, un). Opcionais: unidade_medida, estoque_minimo. Insumos com o mesmo nome têm o preço atualizado.")
+        arq_ins = st.file_uploader("Planilha de insumos / lista de preços", type=["csv", "xlsx"], key="imp_ins_arq")
+        if arq_ins is not None and st.button("Importar Insumos", key="imp_ins_btn"):
+            df_imp = ler_planilha(arq_ins)
+            if df_imp is not None:
+                registros, erros = validar_planilha_insumos(df_imp)
+                if registros:
+                    res = importar_insumos_em_lote(registros)
+                    if res: st.success(f"{res['novos']} novos, {res['atualizados']} atualizados, {res['receitas']} receitas com custo recalculado.")
+                mostrar_relatorio_erros(erros, "insumos")
+
     with st.expander("🗑️ Excluir Insumo"):
         data = run_query("SELECT id, nome FROM insumos ORDER BY nome")
         insumos_del = pd.DataFrame(data) if data else pd.DataFrame()
@@ -201,7 +677,19 @@ with tab2:
     
     data = run_query("SELECT id, nome FROM receitas ORDER BY nome")
     receitas_existentes = pd.DataFrame(data) if data else pd.DataFrame()
-    modo_receita = st.radio("Ação:", ["Nova (Do Zero)", "Clonar/Escalar", "Editar Existente"], horizontal=True)
+    with st.expander("📥 Importar Receitas em Lote (CSV/XLSX)"):
+        st.caption("Uma linha por ingrediente. Colunas: receita, insumo, qtd_usada (na unidade de uso do insumo). Opcional: preco_venda. Receitas com o mesmo nome têm os ingredientes substituídos.")
+        arq_rec = st.file_uploader("Planilha de receitas", type=["csv", "xlsx"], key="imp_rec_arq")
+        if arq_rec is not None and st.button("Importar Receitas", key="imp_rec_btn"):
+            df_imp = ler_planilha(arq_rec)
+            if df_imp is not None:
+                registros, erros = validar_planilha_receitas(df_imp)
+                if registros:
+                    res = importar_receitas_em_lote(registros)
+                    if res: st.success(f"{res['novas']} receitas novas, {res['atualizadas']} atualizadas.")
+                mostrar_relatorio_erros(erros, "receitas")
+
+    modo_receita = st.radio("Ação:", ["Nova (Do Zero)", "Clonar/Escalar", "Editar Existente"], horizontal=True, key="rec_modo")
 
     if modo_receita in ["Clonar/Escalar", "Editar Existente"] and not receitas_existentes.empty:
         sel_receita_nome = st.selectbox("Selecione a Receita", receitas_existentes['nome'])
@@ -469,21 +957,11 @@ with tab3:
                 
                 # FINALIZAR VENDA
                 if st.button("✅ Confirmar Pedido", key="conf_venda"):
-                    resumo = "; ".join([f"{x['qtd']}x {x['produto']}" for x in st.session_state.carrinho])
-                    
-                    # 1. Cria a Venda
-                    vid = run_query("INSERT INTO vendas (cliente, data_pedido, tipo_entrega, endereco, forma_pagamento, itens_resumo, total_venda, status, status_pagamento) VALUES (%s, NOW(), %s, %s, %s, %s, %s, 'Em Produção', 'Pendente') RETURNING id", 
-                              (cli, tipo, end, pagto, resumo, float(tot)))
+                    # Venda, itens e baixa automática de estoque numa transação só (mesma regra da API).
+                    # O carrinho leva o 'total' de cada linha: grava o valor mostrado acima, mesmo que o preço mude depois
+                    vid = run_transaction(lambda cur: pedidos.criar_pedido(cur, cli, tipo, end, pagto, st.session_state.carrinho)[0])
                     
                     if vid:
-                        for i in st.session_state.carrinho: 
-                            # 2. Cria item da venda
-                            run_query("INSERT INTO venda_itens (venda_id, receita_id, qtd) VALUES (%s, %s, %s)", (vid, int(i['id']), int(i['qtd'])))
-                            
-                            # 3. BAIXA AUTOMÁTICA DE ESTOQUE
-                            # Chama a função que desconta os insumos dessa receita
-                            baixar_estoque_por_venda(int(i['id']), float(i['qtd']))
-                        
                         st.session_state.carrinho = []; limpar_sessao(['v_cli', 'v_end']); st.success("Pedido Feito e Estoque Atualizado!"); st.rerun()
 
     with sub_tab_vendedoras:
@@ -542,7 +1020,7 @@ with tab3:
                             
                             # Baixa no Estoque (Venda via Vendedora também desconta estoque da loja?)
                             # Geralmente a entrega para vendedora não baixou estoque ainda, então baixamos agora:
-                            # baixar_estoque_por_venda(int(dados_item['rec_id']), float(qtd_venda_vend))
+                            # run_transaction(lambda cur: pedidos.baixar_estoque(cur, [{'id': int(dados_item['rec_id']), 'qtd': float(qtd_venda_vend)}]))
                             
                             resumo_venda = f"{qtd_venda_vend}x {dados_item['nome']} (Via {vendedora_sel_nome})"
                             if desconto_un > 0: resumo_venda += f" [Desc: R${desconto_un}/un]"
@@ -647,18 +1125,22 @@ with tab_compras:
 with tab_caixa:
     st.header("Financeiro e Relatórios")
     
-    # 1. Dashboard Gráfico
-    data_cx_all = run_query("SELECT * FROM caixa")
+    # 1. Dashboard Gráfico (o arquivo morto só entra se o período pedir)
+    hoje_cx = datetime.now().date()
+    periodo_cx = st.date_input("Período", value=(hoje_cx - timedelta(days=90), hoje_cx), key="cx_periodo")
+    if len(periodo_cx) == 2:
+        data_cx_all = consultar_historico("caixa", "data_movimento", periodo_cx[0], periodo_cx[1])
+    else: data_cx_all = None
+    df_dash = pd.DataFrame(data_cx_all) if data_cx_all else pd.DataFrame(columns=['tipo', 'valor'])
+    
+    # Saldo Atual é de todo o histórico: aparece mesmo se o período não tiver movimento
+    saldos = saldo_por_tipo()
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Entradas no Período", format_currency(df_dash[df_dash['tipo'] == 'Entrada']['valor'].sum()))
+    c2.metric("Saídas no Período", format_currency(df_dash[df_dash['tipo'] == 'Saída']['valor'].sum()))
+    c3.metric("Saldo Atual", format_currency(saldos.get('Entrada', 0) - saldos.get('Saída', 0)))
+    
     if data_cx_all:
-        df_dash = pd.DataFrame(data_cx_all)
-        
-        c1, c2, c3 = st.columns(3)
-        ent = df_dash[df_dash['tipo'] == 'Entrada']['valor'].sum()
-        sai = df_dash[df_dash['tipo'] == 'Saída']['valor'].sum()
-        c1.metric("Total Entradas", format_currency(ent))
-        c2.metric("Total Saídas", format_currency(sai))
-        c3.metric("Saldo Atual", format_currency(ent - sai))
-        
         st.divider()
         col_g1, col_g2 = st.columns(2)
         
@@ -690,8 +1172,7 @@ with tab_caixa:
                 c1, c2 = st.columns([3, 1])
                 c1.write(f"#{r['id']} {r['cliente']} - {format_currency(r['total_venda'])}")
                 if c2.button("Receber", key=f"rec_{r['id']}"):
-                    run_query("UPDATE vendas SET status_pagamento='Pago' WHERE id=%s", (r['id'],))
-                    run_query("INSERT INTO caixa (descricao, valor, data_movimento, tipo, categoria) VALUES (%s, %s, NOW(), 'Entrada', 'Vendas')", (f"Venda #{r['id']}", float(r['total_venda'])))
+                    run_transaction(lambda cur: pedidos.registrar_pagamento(cur, int(r['id'])))
                     st.rerun()
     else: st.info("Nenhuma venda pendente.")
     
@@ -722,6 +1203,27 @@ with tab_caixa:
             if st.button("Excluir Lançamento Selecionado"):
                 id_to_del = int(sel_cx_id.split(" - ")[0]); run_query("DELETE FROM caixa WHERE id=%s", (id_to_del,)); st.success("Excluído!"); st.rerun()
 
+    # 5. Exportação para a Contabilidade (período completo, sem o limite de 50 linhas)
+    with st.expander("📤 Exportar Extrato (CSV/Parquet)"):
+        ex1, ex2, ex3 = st.columns(3)
+        tabela_exp = ex1.selectbox("Dados", ["caixa", "vendas"], format_func=lambda t: "Caixa" if t == "caixa" else "Vendas", key="exp_tabela")
+        periodo_exp = ex2.date_input("Período", value=(hoje_cx.replace(day=1), hoje_cx), key="exp_periodo")
+        formato_exp = ex3.radio("Formato", ["CSV", "Parquet"], horizontal=True, key="exp_formato")
+        cats_exp = st.multiselect("Categorias (vazio = todas)", cats, key="exp_cats") if tabela_exp == "caixa" else []
+        if st.button("Gerar Arquivo", key="exp_btn") and len(periodo_exp) == 2:
+            sufixo = ".csv" if formato_exp == "CSV" else ".parquet"
+            with tempfile.NamedTemporaryFile(suffix=sufixo, delete=False) as tmp: caminho_exp = tmp.name
+            try:
+                barra = st.progress(0.0, text="Exportando...")
+                linhas_exp = exportar_historico(tabela_exp, periodo_exp[0], periodo_exp[1], {'categoria': cats_exp} if cats_exp else {}, formato_exp, caminho_exp, barra)
+                if linhas_exp is not None:
+                    with open(caminho_exp, "rb") as arq_exp:
+                        st.download_button(f"Baixar {linhas_exp} linhas ({formato_exp})", data=arq_exp,
+                                           file_name=f"extrato_{tabela_exp}_{periodo_exp[0]:%Y%m%d}_{periodo_exp[1]:%Y%m%d}{sufixo}",
+                                           mime="text/csv" if formato_exp == "CSV" else "application/octet-stream", key="exp_dl")
+            finally:
+                os.remove(caminho_exp)
+
 # --- Sidebar (BACKUP & RESTORE) ---
 with st.sidebar:
     st.header("Segurança & Backup")
@@ -738,6 +1240,15 @@ with st.sidebar:
         st.success("Backup Gerado! Clique acima para baixar.")
 
     st.divider()
+
+    with st.expander("🗄️ Arquivar Histórico"):
+        st.caption("Move pedidos concluídos e pagos e movimentos de caixa antigos para o arquivo morto. Os relatórios continuam enxergando tudo pelo período.")
+        meses_arq = st.number_input("Arquivar o que tiver mais de (meses)", min_value=1, value=6, step=1, key="arq_meses")
+        if st.button("Arquivar Agora"):
+            res = arquivar_historico(int(meses_arq))
+            if res: st.success(f"Arquivados: {res['vendas']} pedidos e {res['caixa']} movimentos de caixa.")
+
+    st.divider()
     
     # Área de Restauração
     st.write("🔄 **Restaurar Backup**")
@@ -751,3 +1262,6 @@ with st.sidebar:
             st.rerun()
     
     st.info("ℹ️ Este sistema faz backup automático na nuvem, mas recomendamos baixar o backup manual semanalmente.")
+
+# --- Persistência do estado compartilhado (uma escrita por rerun, se algo mudou) ---
+salvar_estado_compartilhado()
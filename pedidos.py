@@ -0,0 +1,72 @@
+# --- Regras de Pedido (compartilhadas entre app.py e api.py) ---
+import math
+
+# Sem Streamlit aqui: as funções recebem um cursor RealDictCursor já dentro de uma transação,
+# e quem chama decide quando gravar (commit) ou desfazer (rollback).
+
+DDL_IDEMPOTENCIA = '''CREATE TABLE IF NOT EXISTS pedidos_idempotencia (chave TEXT PRIMARY KEY, venda_id INTEGER, criado_em TIMESTAMP)'''
+
+def baixar_estoque(cur, itens):
+    # Mesma regra de sempre (qtd_usada x qtd vendida), mas o pedido inteiro num UPDATE só
+    ids = [int(i['id']) for i in itens]
+    qtds = [float(i['qtd']) for i in itens]
+    cur.execute("""
+        UPDATE insumos i SET estoque_atual = i.estoque_atual - c.total
+        FROM (SELECT ri.insumo_id, SUM(ri.qtd_usada * v.qtd) AS total
+              FROM unnest(%s::int[], %s::float8[]) AS v(receita_id, qtd)
+              JOIN receita_itens ri ON ri.receita_id = v.receita_id
+              GROUP BY ri.insumo_id) c
+        WHERE i.id = c.insumo_id
+    """, (ids, qtds))
+
+def registrar_pagamento(cur, venda_id):
+    # Marca como pago e lança a entrada no caixa; não faz nada se já estava pago
+    cur.execute("UPDATE vendas SET status_pagamento = 'Pago' WHERE id = %s AND status_pagamento = 'Pendente' RETURNING total_venda", (venda_id,))
+    row = cur.fetchone()
+    if row is None: return False
+    cur.execute("INSERT INTO caixa (descricao, valor, data_movimento, tipo, categoria) VALUES (%s, %s, NOW(), 'Entrada', 'Vendas')",
+                (f"Venda #{venda_id}", float(row['total_venda'])))
+    return True
+
+def criar_pedido(cur, cliente, tipo_entrega, endereco, forma_pagamento, itens, pago=False, chave=None):
+    # itens: [{'id': receita_id, 'qtd': quantidade}] e, opcional, 'total' da linha já combinado
+    # com o cliente (carrinho do app); sem 'total', vale o preco_venda atual da receita
+    # chave: idempotência; repetir a mesma chave devolve o pedido já criado em vez de duplicar
+    # Retorna (venda_id, repetido). Dados inválidos levantam ValueError.
+    if not itens: raise ValueError("Pedido sem itens")
+    for i in itens:
+        qtd = float(i['qtd'])
+        if not math.isfinite(qtd) or qtd <= 0 or qtd != int(qtd): raise ValueError(f"Quantidade inválida: {i['qtd']}")
+
+    if chave:
+        cur.execute("INSERT INTO pedidos_idempotencia (chave, criado_em) VALUES (%s, NOW()) ON CONFLICT (chave) DO NOTHING RETURNING chave", (chave,))
+        if cur.fetchone() is None:
+            cur.execute("SELECT venda_id FROM pedidos_idempotencia WHERE chave = %s", (chave,))
+            return cur.fetchone()['venda_id'], True
+
+    ids = [int(i['id']) for i in itens]
+    qtds = [int(float(i['qtd'])) for i in itens]
+    cur.execute("SELECT id, nome, preco_venda FROM receitas WHERE id = ANY(%s)", (list(set(ids)),))
+    receitas = {r['id']: r for r in cur.fetchall()}
+    faltando = [str(rid) for rid in ids if rid not in receitas]
+    if faltando: raise ValueError(f"Receita não encontrada: {', '.join(faltando)}")
+
+    totais = [float(i['total']) if i.get('total') is not None else q * float(receitas[rid]['preco_venda'] or 0) for i, rid, q in zip(itens, ids, qtds)]
+    if not all(math.isfinite(t) and t >= 0 for t in totais): raise ValueError("Total de item inválido")
+    total = sum(totais)
+    resumo = "; ".join(f"{q}x {receitas[rid]['nome']}" for rid, q in zip(ids, qtds))
+
+    # 1. Cria a Venda
+    cur.execute("INSERT INTO vendas (cliente, data_pedido, tipo_entrega, endereco, forma_pagamento, itens_resumo, total_venda, status, status_pagamento) VALUES (%s, NOW(), %s, %s, %s, %s, %s, 'Em Produção', 'Pendente') RETURNING id",
+                (cliente, tipo_entrega, endereco, forma_pagamento, resumo, float(total)))
+    venda_id = cur.fetchone()['id']
+
+    # 2. Itens da venda e 3. baixa automática de estoque
+    cur.execute("INSERT INTO venda_itens (venda_id, receita_id, qtd) SELECT %s, unnest(%s::int[]), unnest(%s::int[])", (venda_id, ids, qtds))
+    baixar_estoque(cur, [{'id': rid, 'qtd': q} for rid, q in zip(ids, qtds)])
+
+    # 4. Já pago? Entra no caixa
+    if pago: registrar_pagamento(cur, venda_id)
+
+    if chave: cur.execute("UPDATE pedidos_idempotencia SET venda_id = %s WHERE chave = %s", (venda_id, chave))
+    return venda_id, False